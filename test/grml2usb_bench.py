@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+grml2usb benchmarks
+~~~~~~~~~~~~~~~~~~~
+
+This script measures the install pipeline of grml2usb on ISO-like trees
+synthesized from test/iso-contents, installing them to a directory (no root
+needed). It is not collected by pytest.
+
+Each synthesized ISO carries its own flavour, a squashfs file of the given size
+and additional files below GRML/<flavour>/. All ISOs are installed to the same
+target, like a multi-flavour USB stick. The time spent in the functions of the
+config and copy paths and in each phase of the run is recorded, the best of all
+rounds is reported. Additionally the startup time of the grml2usb script is
+measured for invocations which do not install anything, like --help.
+
+Runwith:
+<project root>$ python3 test/grml2usb_bench.py [--flavours N] [--files N] [--squashfs-size MiB] [--baseline FILE]
+
+With --baseline the results are compared against FILE and the script fails if
+a timing got slower than the given tolerance. If FILE does not exist yet, the
+results are written to it instead.
+
+:license: GPL v2 or any later version
+:bugreports: http://grml.org/bugs/
+"""
+
+import argparse
+import functools
+import importlib
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+grml2usb = importlib.import_module("grml2usb")
+
+SCRIPT = Path(__file__).absolute().parent.parent / "grml2usb"
+FIXTURE = Path(__file__).absolute().parent / "iso-contents" / "grml-full-2025.12-amd64"
+FIXTURE_FLAVOUR = "grml-full-amd64"
+FILES_PER_DIRECTORY = 100
+MEASURED_FUNCTIONS = (
+    "identify_grml_flavour",
+    "search_file",
+    "copy_bootloader_files",
+    "handle_syslinux_config",
+    "handle_grub_config",
+    "install_grml",
+)
+STARTUP_COMMANDS = (["--help"], ["--version"])
+STARTUP_RUNS = 10
+
+
+def flavour_names(index: int) -> dict[str, str]:
+    """Map the names of the fixture flavour to the ones of the synthesized flavour index"""
+    flavour = f"grml-bench{index}-amd64"
+    return {FIXTURE_FLAVOUR: flavour, FIXTURE_FLAVOUR.replace("-", ""): flavour.replace("-", "")}
+
+
+def rename(text: str, names: dict[str, str]) -> str:
+    for old, new in names.items():
+        text = text.replace(old, new)
+    return text
+
+
+def build_efi_image(workdir: Path) -> Path:
+    """Create an efi.img with the files handle_secure_boot() looks for, readable without mounting it"""
+    source = workdir / "efi"
+    (source / "EFI" / "BOOT").mkdir(parents=True)
+    (source / "boot" / "grub").mkdir(parents=True)
+    (source / "EFI" / "BOOT" / "bootx64.efi").write_bytes(bytes(512 * 1024))
+    (source / "EFI" / "BOOT" / "grubx64.efi").write_bytes(bytes(2 * 1024 * 1024))
+    (source / "boot" / "grub" / "grub.cfg").write_text("search --set=root --file /conf/bootid.txt\n")
+    image = workdir / "efi.img"
+    grml2usb.build_fat_image(str(source), str(image))
+    return image
+
+
+def synthesize_iso(destination: Path, index: int, files: int, squashfs_size: int, efi_img: Path) -> str:
+    """Create an ISO-like tree of the fixture with its own flavour
+
+    @destination: directory to create
+    @index: number of the flavour
+    @files: number of additional files below GRML/<flavour>/
+    @squashfs_size: size of the squashfs file in bytes
+    @efi_img: efi.img to install in the tree
+    @return: name of the flavour"""
+    names = flavour_names(index)
+    for source in sorted(FIXTURE.rglob("*")):
+        target = destination / rename(str(source.relative_to(FIXTURE)), names)
+        if source.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            target.write_text(rename(source.read_text(), names))
+        except UnicodeDecodeError:
+            shutil.copyfile(source, target)
+
+    zeroed = FIXTURE.parent / (FIXTURE.name + ".zeroed")
+    for filename in zeroed.read_text().splitlines():
+        target = destination / rename(filename, names)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.touch()
+    shutil.copyfile(efi_img, destination / "boot" / "efi.img")
+
+    flavour = names[FIXTURE_FLAVOUR]
+    block = os.urandom(1024 * 1024)
+    with open(destination / "live" / flavour / f"{flavour}.squashfs", "wb") as squashfs:
+        for offset in range(0, squashfs_size, len(block)):
+            squashfs.write(block[: squashfs_size - offset])
+
+    for number in range(files):
+        directory = destination / "GRML" / flavour / "bench" / f"{number // FILES_PER_DIRECTORY:04d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"file{number:06d}.txt").write_text(f"{flavour} {number}\n" * 16)
+    return flavour
+
+
+class Timings:
+    """Accumulate the time spent in functions of the grml2usb module"""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+
+    def wrap(self, name: str):
+        function = getattr(grml2usb, name)
+
+        @functools.wraps(function)
+        def measured(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+        setattr(grml2usb, name, measured)
+        return function
+
+
+def run_round(isos: list[str], workdir: Path, number: int) -> dict[str, float]:
+    """Install all isos to a fresh target directory and return the measured timings"""
+    target = workdir / f"target{number}"
+    target.mkdir()
+    grml2usb.options = grml2usb.parser.parse_args(
+        ["--copy-engine", "native", "--force", "--userspace-iso", "--tmpdir", str(workdir), *isos, str(target)]
+    )
+    grml2usb.COPY_ENGINE = "native"
+    grml2usb.GRML_FLAVOURS.clear()
+    grml2usb.PROGRESS = grml2usb.ProgressReporter()
+    grml2usb.DEDUP = grml2usb.Deduplicator()
+
+    timings = Timings()
+    originals = {name: timings.wrap(name) for name in MEASURED_FUNCTIONS}
+    start = time.perf_counter()
+    try:
+        for iso in isos:
+            grml2usb.install(iso, str(target))
+        grml2usb.DEDUP.close()
+    finally:
+        for name, function in originals.items():
+            setattr(grml2usb, name, function)
+        grml2usb.cleanup()
+    results = {"total": time.perf_counter() - start}
+    results.update(timings.seconds)
+    results.update({f"phase:{name}": seconds for name, seconds in grml2usb.PROGRESS.phases.items()})
+    grml2usb.PROGRESS = None
+    shutil.rmtree(target)
+    return results
+
+
+def measure_startup() -> dict[str, float]:
+    """Return the best wall time of running the grml2usb script with each of STARTUP_COMMANDS"""
+    results = {}
+    for arguments in STARTUP_COMMANDS:
+        best = None
+        for _ in range(STARTUP_RUNS):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, str(SCRIPT), *arguments], check=True, capture_output=True)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        results[f"startup:{' '.join(arguments)}"] = best
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return the timings of results that are slower than in baseline by more than tolerance"""
+    regressions = []
+    for name, seconds in results["timings"].items():
+        before = baseline["timings"].get(name)
+        # ignore noise on timings too short to be measured reliably
+        if before is None or seconds < 0.01:
+            continue
+        if seconds > before * tolerance:
+            regressions.append(f"{name}: {before:.3f}s -> {seconds:.3f}s")
+    if baseline.get("parameters") != results["parameters"]:
+        logging.warning("Baseline was recorded with different parameters: %s", baseline.get("parameters"))
+    return regressions
+
+
+def main() -> None:
+    bench_parser = argparse.ArgumentParser(description="Benchmark the grml2usb install pipeline")
+    bench_parser.add_argument("--flavours", type=int, default=2, help="number of ISOs/flavours to install")
+    bench_parser.add_argument("--files", type=int, default=1000, help="additional files per ISO")
+    bench_parser.add_argument("--squashfs-size", type=int, default=64, help="size of each squashfs file in MiB")
+    bench_parser.add_argument("--rounds", type=int, default=3, help="number of runs, the best one is reported")
+    bench_parser.add_argument("--baseline", help="JSON file to compare against, written if it does not exist")
+    bench_parser.add_argument("--output", help="write the results as JSON to this file")
+    bench_parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown against the baseline")
+    bench_options = bench_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    parameters = {
+        "flavours": bench_options.flavours,
+        "files": bench_options.files,
+        "squashfs_size": bench_options.squashfs_size,
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="grml2usb-bench"))
+    try:
+        efi_img = build_efi_image(workdir)
+        isos = []
+        for index in range(bench_options.flavours):
+            iso = workdir / f"iso{index}"
+            synthesize_iso(iso, index, bench_options.files, bench_options.squashfs_size * 1024 * 1024, efi_img)
+            isos.append(str(iso))
+
+        best: dict[str, float] = {}
+        for number in range(bench_options.rounds):
+            for name, seconds in run_round(isos, workdir, number).items():
+                best[name] = min(seconds, best.get(name, seconds))
+    finally:
+        shutil.rmtree(workdir)
+    best.update(measure_startup())
+
+    results = {
+        "parameters": parameters,
+        "python": platform.python_version(),
+        "timings": {name: round(seconds, 4) for name, seconds in sorted(best.items())},
+    }
+    for name, seconds in results["timings"].items():
+        print(f"{name:30} {seconds:10.4f}s")
+    if bench_options.output:
+        Path(bench_options.output).write_text(json.dumps(results, indent=2) + "\n")
+
+    if not bench_options.baseline:
+        return
+    baseline_file = Path(bench_options.baseline)
+    if not baseline_file.exists():
+        baseline_file.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline written to {baseline_file}")
+        return
+    regressions = compare(results, json.loads(baseline_file.read_text()), bench_options.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
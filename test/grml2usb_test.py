@@ -16,12 +16,19 @@ Runwith:
 """
 
 import argparse
+import hashlib
 import importlib
 import json
 import logging
 import os
 import shutil
+import signal
+import socket
+import struct
 import subprocess
+import sys
+import threading
+import time
 import uuid
 from pathlib import Path
 
@@ -72,6 +79,41 @@ def test_which_skips_non_executable_files(tmp_path, monkeypatch):
     assert grml2usb.which("program") is None
 
 
+def test_which_follows_path_changes(tmp_path, monkeypatch):
+    """which results are cached per PATH, changing PATH looks up the program again"""
+    for directory in ("first", "second"):
+        (tmp_path / directory).mkdir()
+        program = tmp_path / directory / "program"
+        program.touch()
+        program.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path / "first"))
+    assert grml2usb.which("program") == str(tmp_path / "first" / "program")
+    monkeypatch.setenv("PATH", str(tmp_path / "second"))
+    assert grml2usb.which("program") == str(tmp_path / "second" / "program")
+
+
+def test_load_loop_once(monkeypatch):
+    """modprobe loop runs once per process, not for every ISO or efi.img mounted"""
+    commands = []
+    monkeypatch.setattr(grml2usb, "which", lambda program: "/sbin/" + program)
+    monkeypatch.setattr(grml2usb, "run_program", lambda command, **kwargs: commands.append(command))
+    grml2usb.load_loop.cache_clear()
+    try:
+        grml2usb.load_loop()
+        grml2usb.reset_run_state()
+        grml2usb.load_loop()
+    finally:
+        grml2usb.load_loop.cache_clear()
+    assert commands == [["modprobe", "loop"]]
+
+
+def test_version_option(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        grml2usb.parser.parse_args(["--version"])
+    assert exit_info.value.code == 0
+    assert capsys.readouterr().out.strip().endswith(grml2usb.get_version())
+
+
 def test_write_uuid(tmp_path):
     target_file = tmp_path / "test_uuid.txt"
     returned_uid = grml2usb.write_uuid(target_file)
@@ -179,6 +221,1095 @@ def test_search_dirs_not_found(tmp_path):
     assert grml2usb.search_dirs(filename, str(tmp_path)) == []
 
 
+def test_search_file_uses_index(tmp_path, iso_contents: Path):
+    iso_mount = str(iso_contents / "grml-full-2025.12-amd64")
+    expected = {
+        name: (grml2usb.search_file(name, iso_mount), grml2usb.search_dirs(name, iso_mount))
+        for name in ("grml-version", "bootx64.efi", "efi.img", "grml-full-amd64/filesystem.module", "missing")
+    }
+
+    grml2usb.index_tree(iso_mount)
+    try:
+        assert grml2usb.get_index(iso_mount + "/boot/") is not None
+        for name, (first, every) in expected.items():
+            assert grml2usb.search_file(name, iso_mount) == first
+            assert grml2usb.search_dirs(name, iso_mount) == every
+        # files in a subtree are only found below the specified search path
+        assert grml2usb.search_file("grml-version", iso_mount + "/boot") is None
+    finally:
+        grml2usb.drop_index(iso_mount)
+
+    assert grml2usb.get_index(iso_mount) is None
+
+
+def test_search_file_index_walk_order(tmp_path):
+    # "sub/x" in tmp_path itself must win over the one found in a deeper directory
+    (tmp_path / "a" / "sub").mkdir(parents=True)
+    (tmp_path / "a" / "sub" / "x").touch()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "x").touch()
+
+    grml2usb.index_tree(str(tmp_path))
+    try:
+        assert grml2usb.search_file("sub/x", str(tmp_path)) == str(tmp_path / "sub" / "x")
+        assert sorted(grml2usb.search_dirs("x", str(tmp_path))) == [
+            str(tmp_path / "a" / "sub" / "x"),
+            str(tmp_path / "sub" / "x"),
+        ]
+    finally:
+        grml2usb.drop_index(str(tmp_path))
+
+
+def test_install_pipelined(tmp_path, monkeypatch, iso_contents: Path):
+    options = argparse.Namespace()
+    options.bootloaderonly = False
+    options.copyonly = False
+    options.dedup = True
+    options.dryrun = False
+    options.force = True
+    options.incremental = False
+    options.skipaddons = False
+    options.synconce = True
+    options.tmpdir = str(tmp_path)
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "GRML_FLAVOURS", set())
+    monkeypatch.setattr(grml2usb, "DEDUP", None)
+
+    copied = []
+    installed = []
+    synced = []
+    monkeypatch.setattr(
+        grml2usb, "copy_flavour_files", lambda flavour, *args: copied.append((flavour, dict(grml2usb.MIRRORS)))
+    )
+    monkeypatch.setattr(
+        grml2usb,
+        "install_iso_files",
+        lambda flavour, mountpoint, target, copy_files: installed.append((flavour, target, copy_files)),
+    )
+    monkeypatch.setattr(grml2usb, "sync_target", lambda target: synced.append((target, len(installed))))
+
+    isos = [str(iso_contents / "grml-full-2025.12-arm64"), str(iso_contents / "grml-full-2025.12-amd64")]
+    targets = [str(tmp_path / "target1"), str(tmp_path / "target2")]
+    for target in targets:
+        os.mkdir(target)
+    grml2usb.install_pipelined(isos, targets, 2)
+
+    # the flavour files are copied once, mirrored to the second device
+    mirrors = {targets[0]: [targets[1]]}
+    assert sorted(copied) == [("grml-full-amd64", mirrors), ("grml-full-arm64", mirrors)]
+    # bootloader files and configuration are installed in command line order
+    assert installed == [
+        ("grml-full-arm64", targets[0], False),
+        ("grml-full-amd64", targets[0], False),
+        ("grml-full-arm64", targets[1], False),
+        ("grml-full-amd64", targets[1], False),
+    ]
+    # with --sync-once the devices are synced after all files are installed
+    assert synced == [(targets[0], 4), (targets[1], 4)]
+    # the ISOs share files, which are written only once
+    assert isinstance(grml2usb.DEDUP, grml2usb.Deduplicator)
+    assert grml2usb.GRML_FLAVOURS == {"grml-full-amd64", "grml-full-arm64"}
+    assert grml2usb.FILE_INDEXES == {}
+    assert grml2usb.MIRRORS == {}
+
+
+def test_install_pipelined_device_failure(tmp_path, monkeypatch, iso_contents: Path):
+    options = argparse.Namespace()
+    options.bootloaderonly = False
+    options.copyonly = False
+    options.dryrun = False
+    options.force = True
+    options.incremental = False
+    options.skipaddons = False
+    options.synconce = False
+    options.tmpdir = str(tmp_path)
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "GRML_FLAVOURS", set())
+
+    targets = [str(tmp_path / "target1"), str(tmp_path / "target2"), str(tmp_path / "target3")]
+    for target in targets:
+        os.mkdir(target)
+    copied = []
+
+    def copy_flavour_files(flavour, mountpoint, target):
+        copied.append((target, grml2usb.MIRRORS[target]))
+        if len(copied) == 1:
+            grml2usb.copy_failed(target + "/live", "No space left on device")
+        for mirror in grml2usb.MIRRORS[target]:
+            grml2usb.exec_copy(str(tmp_path / "source"), mirror + "/")
+
+    installed = []
+    monkeypatch.setattr(grml2usb, "copy_flavour_files", copy_flavour_files)
+    monkeypatch.setattr(
+        grml2usb, "install_iso_files", lambda flavour, mountpoint, target, copy_files: installed.append(target)
+    )
+    # writing the third device fails as well
+    monkeypatch.setattr(
+        grml2usb,
+        "exec_copy",
+        lambda source, target: target.startswith(targets[2]) and grml2usb.copy_failed(target, "I/O error"),
+    )
+
+    iso = str(iso_contents / "grml-full-2025.12-amd64")
+    assert grml2usb.install_pipelined([iso], targets, 1) == [targets[0], targets[2]]
+    # the files are copied again for the remaining devices
+    assert copied == [(targets[0], targets[1:]), (targets[1], targets[2:]), (targets[1], [])]
+    assert installed == [targets[1]]
+    assert grml2usb.DEVICE_TARGETS == []
+
+
+def test_kept_source(tmp_path, monkeypatch, iso_contents: Path):
+    options = argparse.Namespace()
+    options.force = True
+    options.tmpdir = str(tmp_path)
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "KEPT_SOURCES", {})
+
+    iso = str(iso_contents / "grml-full-2025.12-amd64")
+    source = grml2usb.Source(iso)
+    grml2usb.KEPT_SOURCES[source.image] = source
+    assert source.flavours == ["grml-full-amd64"]
+
+    # further runs use the kept source without indexing or identifying it again
+    monkeypatch.setattr(grml2usb, "index_tree", lambda mountpoint: pytest.fail(f"{mountpoint} indexed again"))
+    monkeypatch.setattr(grml2usb, "identify_grml_flavour", lambda mountpoint: pytest.fail(f"{mountpoint} identified"))
+    assert grml2usb.mount_source(iso) == (source.mountpoint, False)
+    assert grml2usb.get_install_flavours(source.mountpoint) == ["grml-full-amd64"]
+    grml2usb.release_source(source.mountpoint, False)
+    assert source.mountpoint in grml2usb.FILE_INDEXES
+    assert source.valid()
+
+    source.close()
+    assert grml2usb.KEPT_SOURCES == {}
+    assert source.mountpoint not in grml2usb.FILE_INDEXES
+
+
+def test_iso_cache(tmp_path, monkeypatch, iso_contents: Path):
+    mountpoint = str(iso_contents / "grml-full-2025.12-amd64")
+    image = tmp_path / "grml.iso"
+    image.write_bytes(os.urandom(4096))
+    cache = grml2usb.IsoCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(grml2usb, "ISO_CACHE", cache)
+
+    cache.attach(str(image), mountpoint)
+    grml2usb.index_tree(mountpoint)
+    expected = grml2usb.search_dirs("grml-version", mountpoint)
+    assert grml2usb.get_install_flavours(mountpoint) == ["grml-full-amd64"]
+    efi_dir = tmp_path / "efi"
+    (efi_dir / "EFI" / "BOOT").mkdir(parents=True)
+    (efi_dir / "EFI" / "BOOT" / "bootx64.efi").write_bytes(b"shim")
+    efi_digest = hashlib.sha256(b"efi.img").hexdigest()
+    cache.store_efi_files(mountpoint + "/boot/efi.img", str(efi_dir), efi_digest)
+    grml2usb.release_source(mountpoint, False)
+
+    # a further run with the same ISO neither walks its tree nor parses grml-version
+    monkeypatch.setattr(grml2usb.os, "walk", lambda path: pytest.fail(f"{path} walked"))
+    monkeypatch.setattr(grml2usb, "identify_grml_flavour", lambda path: pytest.fail(f"{path} identified"))
+    cache.attach(str(image), mountpoint)
+    try:
+        grml2usb.index_tree(mountpoint)
+        assert grml2usb.search_dirs("grml-version", mountpoint) == expected
+        assert grml2usb.get_install_flavours(mountpoint) == ["grml-full-amd64"]
+    finally:
+        grml2usb.release_source(mountpoint, False)
+    monkeypatch.undo()
+
+    # the files of efi.img are found by its digest, and only used if they are unchanged
+    cache.attach(str(image), mountpoint)
+    assert cache.efi_files(mountpoint + "/boot/efi.img", hashlib.sha256(b"other").hexdigest()) is None
+    cached = cache.efi_files(mountpoint + "/boot/efi.img", efi_digest)
+    assert cached is not None
+    assert Path(cached, "EFI", "BOOT", "bootx64.efi").read_bytes() == b"shim"
+    Path(cached, "EFI", "BOOT", "bootx64.efi").write_bytes(b"evil")
+    assert cache.efi_files(mountpoint + "/boot/efi.img", efi_digest) is None
+    cache.detach(mountpoint)
+
+    # a changed ISO has its own entry, the least recently used entries are evicted
+    image.write_bytes(os.urandom(4096))
+    monkeypatch.setattr(grml2usb, "ISO_CACHE_MAX_SIZE", 1)
+    cache.attach(str(image), mountpoint)
+    assert cache.efi_files(mountpoint + "/boot/efi.img", efi_digest) is None
+    cache.store(mountpoint, "flavours", ["grml-full-amd64"])
+    cache.close()
+    assert os.listdir(tmp_path / "cache") == []
+
+    # the cache is private to its user
+    (tmp_path / "cache").chmod(0o755)
+    grml2usb.IsoCache(str(tmp_path / "cache"))
+    assert (tmp_path / "cache").stat().st_mode & 0o777 == 0o700
+    monkeypatch.setattr(os, "geteuid", lambda: os.getuid() + 1)
+    with pytest.raises(PermissionError):
+        grml2usb.IsoCache(str(tmp_path / "cache"))
+
+
+def test_daemon_job(tmp_path, monkeypatch):
+    # sessions set the module globals, restore them afterwards
+    monkeypatch.setattr(grml2usb, "options", None)
+    monkeypatch.setattr(grml2usb, "GRML_FLAVOURS", set())
+    monkeypatch.setattr(grml2usb, "GRML_DEFAULT", None)
+    monkeypatch.setattr(grml2usb, "cleanup", lambda: None)
+    monkeypatch.chdir(tmp_path)
+    runs = []
+
+    def run_installation(keep):
+        runs.append((grml2usb.options.isos, grml2usb.options.daemonsocket, keep, os.getcwd()))
+        if grml2usb.options.dryrun:
+            logging.critical("Fatal: failing as requested")
+            sys.exit(1)
+        if grml2usb.options.isos[0] == "stop.iso":
+            grml2usb.stop_daemon(signal.SIGTERM, None)
+        if grml2usb.options.isos[0] == "exit.iso":
+            sys.exit(0)
+        logging.info("Installing %s", grml2usb.options.isos[0])
+        grml2usb.GRML_FLAVOURS.add("grml-full-amd64")
+        grml2usb.GRML_DEFAULT = "grml-full-amd64"
+
+    monkeypatch.setattr(grml2usb, "run_installation", run_installation)
+
+    session = grml2usb.Session(grml2usb.parser.parse_args(["grml.iso", "/dev/sdx1"]))
+    session.run()
+    assert session.flavours == {"grml-full-amd64"}
+    assert session.default_flavour == "grml-full-amd64"
+
+    def submit(argv):
+        client, server = socket.socketpair()
+        with client, server:
+            grml2usb.send_message(client, argv=argv, cwd="/")
+            grml2usb.run_job(server, 2)
+            server.shutdown(socket.SHUT_WR)
+            return [json.loads(line) for line in client.makefile("rb")]
+
+    messages = submit(["--daemon-socket", "/run/grml2usb.sock", "grml.iso", "/dev/sdx1"])
+    assert messages == [{"log": "Installing grml.iso"}, {"exit": 0}]
+    assert runs[-1] == (["grml.iso"], None, 2, "/")
+    messages = submit(["--dry-run", "grml.iso", "/dev/sdx1"])
+    assert messages == [{"log": "Fatal: failing as requested"}, {"exit": 1}]
+    messages = submit(["exit.iso", "/dev/sdx1"])
+    assert messages == [{"exit": 1}]
+
+    # the client of the running job is told before the daemon stops
+    with pytest.raises(grml2usb.DaemonShutdown):
+        submit(["stop.iso", "/dev/sdx1"])
+
+
+def test_remove_stale_socket(tmp_path):
+    socket_path = str(tmp_path / "grml2usb.sock")
+    grml2usb.remove_stale_socket(socket_path)
+
+    (tmp_path / "grml2usb.sock").write_text("not a socket")
+    with pytest.raises(grml2usb.CriticalException):
+        grml2usb.remove_stale_socket(socket_path)
+    os.unlink(socket_path)
+
+    # the socket of a running daemon stays, the one of a stopped daemon is removed
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        with pytest.raises(grml2usb.CriticalException):
+            grml2usb.remove_stale_socket(socket_path)
+        assert os.path.exists(socket_path)
+    grml2usb.remove_stale_socket(socket_path)
+    assert not os.path.exists(socket_path)
+
+
+def test_reset_run_state(monkeypatch):
+    monkeypatch.setattr(grml2usb, "NATIVE_COPY_CHUNK_SIZE", 64 * 1024**2)
+    monkeypatch.setattr(grml2usb, "MIRRORS", {"/mnt/a": ["/mnt/b"]})
+    monkeypatch.setattr(grml2usb, "DEVICE_TARGETS", ["/mnt/a", "/mnt/b"])
+    monkeypatch.setattr(grml2usb, "INSTALL_MANIFEST", object())
+    monkeypatch.setattr(grml2usb, "CONFIG_CACHE", object())
+    monkeypatch.setattr(grml2usb, "DEDUP", object())
+    monkeypatch.setattr(grml2usb, "GRML_FLAVOURS", {"grml-full-amd64"})
+    kept = argparse.Namespace(mountpoint="/tmp/kept")
+    monkeypatch.setattr(grml2usb, "KEPT_SOURCES", {"/srv/grml.iso": kept})
+    monkeypatch.setattr(
+        grml2usb,
+        "ISO_EXTENTS",
+        {"/tmp/kept/live/big.squashfs": ("/srv/grml.iso", []), "/tmp/staging/big.squashfs": ("/srv/old.iso", [])},
+    )
+    grml2usb.reset_run_state()
+    assert grml2usb.NATIVE_COPY_CHUNK_SIZE == grml2usb.NATIVE_COPY_CHUNK_DEFAULT
+    assert grml2usb.MIRRORS == {}
+    assert grml2usb.DEVICE_TARGETS == []
+    assert grml2usb.INSTALL_MANIFEST is None and grml2usb.CONFIG_CACHE is None and grml2usb.DEDUP is None
+    assert grml2usb.GRML_FLAVOURS == set()
+    assert list(grml2usb.ISO_EXTENTS) == ["/tmp/kept/live/big.squashfs"]
+
+
+def test_check_install_plan(tmp_path, monkeypatch, caplog, iso_contents: Path):
+    options = argparse.Namespace()
+    options.bootloaderonly = False
+    options.copyonly = False
+    options.dryrun = False
+    options.skipaddons = False
+    monkeypatch.setattr(grml2usb, "options", options)
+    iso_mount = str(tmp_path / "iso")
+    shutil.copytree(iso_contents / "grml-full-2025.12-amd64", iso_mount)
+    Path(iso_mount, "live", "grml-full-amd64", "grml-full-amd64.squashfs").write_bytes(bytes(10 * 4096 + 1))
+    target = tmp_path / "target"
+    (target / "live" / "grml-full-amd64").mkdir(parents=True)
+    (target / "live" / "grml-full-amd64" / "filesystem.module").write_text("old")
+
+    copies = grml2usb.plan_iso_files("grml-full-amd64", iso_mount, str(target))
+    destinations = {os.path.relpath(destination, target) for _source, destination in copies}
+    assert "live/grml-full-amd64/grml-full-amd64.squashfs" in destinations
+    assert "boot/grub/grub.cfg" in destinations
+
+    class FakeStatvfs:
+        f_frsize = 4096
+        f_bsize = 4096
+        f_bavail = 10
+
+    monkeypatch.setattr(os, "statvfs", lambda path: FakeStatvfs)
+    with pytest.raises(SystemExit):
+        grml2usb.check_install_plan(copies, str(target))
+    assert "not enough space left on device" in caplog.text
+
+    # --dry-run shows the plan and does not abort
+    caplog.clear()
+    caplog.set_level(logging.INFO)
+    options.dryrun = True
+    grml2usb.check_install_plan(copies, str(target))
+    assert "live/grml-full-amd64/grml-full-amd64.squashfs" in caplog.text
+    assert "Estimated copy time" in caplog.text
+
+    # several ISOs installed one after the other are checked together, before the first one is written
+    options.dryrun = False
+    second_mount = str(tmp_path / "second")
+    shutil.copytree(iso_mount, second_mount)
+    installed = []
+    monkeypatch.setattr(grml2usb, "mount_source", lambda image: (image, False))
+    monkeypatch.setattr(grml2usb, "release_source", lambda mountpoint, remove: None)
+    monkeypatch.setattr(grml2usb, "get_install_flavours", lambda mountpoint: ["grml-full-amd64"])
+    monkeypatch.setattr(grml2usb, "install_grml", lambda *args, **kwargs: installed.append(args))
+    with pytest.raises(SystemExit):
+        grml2usb.install([iso_mount, second_mount], str(target))
+    assert installed == []
+    monkeypatch.setattr(FakeStatvfs, "f_bavail", 1024**2)
+    grml2usb.install([iso_mount, second_mount], str(target))
+    assert installed == [(iso_mount, str(target)), (second_mount, str(target))]
+
+
+def test_exec_native_copy(tmp_path):
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    (source / "small").write_text("small")
+    large_data = os.urandom(3 * 1024 * 1024 + 17)
+    (source / "sub" / "large").write_bytes(large_data)
+    os.utime(source / "small", ns=(1_000_000_000, 1_000_000_000))
+    target = tmp_path / "target"
+    target.mkdir()
+
+    # same semantics as rsync: trailing slashes matter
+    grml2usb.exec_native_copy(str(source / "small"), str(target / "newdir") + "/")
+    grml2usb.exec_native_copy(str(source / "small"), str(target / "renamed"))
+    grml2usb.exec_native_copy(str(source / "sub"), str(target))
+    grml2usb.exec_native_copy(str(source) + "/", str(target / "contents"))
+
+    assert (target / "newdir" / "small").read_text() == "small"
+    assert (target / "renamed").read_text() == "small"
+    assert (target / "renamed").stat().st_mtime_ns == 1_000_000_000
+    assert (target / "sub" / "large").read_bytes() == large_data
+    assert (target / "contents" / "small").read_text() == "small"
+    assert (target / "contents" / "sub" / "large").read_bytes() == large_data
+
+
+def test_exec_copy_mirrors(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    source = tmp_path / "source"
+    (source / "live").mkdir(parents=True)
+    large_data = os.urandom(2 * grml2usb.NATIVE_COPY_SMALL_FILE + 1)
+    (source / "live" / "large.squashfs").write_bytes(large_data)
+    (source / "live" / "small").write_text("small")
+    targets = [tmp_path / "target1", tmp_path / "target2", tmp_path / "target3"]
+    for target in targets:
+        target.mkdir()
+    monkeypatch.setattr(grml2usb, "MIRRORS", {str(targets[0]): [str(target) for target in targets[1:]]})
+
+    grml2usb.exec_copy(str(source / "live"), str(targets[0] / "boot") + "/")
+
+    for target in targets:
+        assert (target / "boot" / "live" / "large.squashfs").read_bytes() == large_data
+        assert (target / "boot" / "live" / "small").read_text() == "small"
+
+    # a failing device is reported, not the device the data is read for
+    monkeypatch.setattr(grml2usb, "DEVICE_TARGETS", [str(target) for target in targets])
+    (targets[2] / "boot" / "live" / "large.squashfs").unlink()
+    (targets[2] / "boot" / "live" / "large.squashfs").mkdir()
+    with pytest.raises(grml2usb.DeviceException) as error:
+        grml2usb.exec_copy(str(source / "live"), str(targets[0] / "boot") + "/")
+    assert error.value.mountpoint == str(targets[2])
+
+
+def test_exec_copy_dedup(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    monkeypatch.setattr(grml2usb, "DEDUP", grml2usb.Deduplicator())
+    copies = []
+    native_copy = grml2usb.exec_native_copy
+    monkeypatch.setattr(
+        grml2usb, "exec_native_copy", lambda source, *args: copies.append(source) or native_copy(source, *args)
+    )
+    for iso in ("iso1", "iso2"):
+        (tmp_path / iso / "grub").mkdir(parents=True)
+        (tmp_path / iso / "grub" / "grub.cfg").write_text("menuentry")
+        (tmp_path / iso / "grub" / "font.pf2").write_bytes(b"font")
+    target = tmp_path / "target"
+    target.mkdir()
+
+    grml2usb.exec_copy(str(tmp_path / "iso1" / "grub"), str(target) + "/")
+    # identical content written by this run already
+    grml2usb.exec_copy(str(tmp_path / "iso2" / "grub"), str(target) + "/")
+    assert copies == [str(tmp_path / "iso1" / "grub")]
+    assert (grml2usb.DEDUP.saved_files, grml2usb.DEDUP.saved_bytes) == (2, 13)
+
+    # modified or removed files are copied again
+    grml2usb.write_config(target / "grub" / "grub.cfg", "modified")
+    grml2usb.exec_copy(str(tmp_path / "iso2" / "grub" / "grub.cfg"), str(target / "grub") + "/")
+    (target / "grub" / "font.pf2").unlink()
+    grml2usb.exec_copy(str(tmp_path / "iso2" / "grub" / "font.pf2"), str(target / "grub") + "/")
+    assert len(copies) == 3
+    assert (target / "grub" / "grub.cfg").read_text() == "menuentry"
+    assert (target / "grub" / "font.pf2").read_bytes() == b"font"
+
+    # each ISO is installed with the target device mounted at a new place
+    monkeypatch.setattr(grml2usb, "DEDUP", grml2usb.Deduplicator())
+    mountpoints = [tmp_path / "mnt1", tmp_path / "mnt2"]
+    monkeypatch.setattr(os.path, "ismount", lambda path: path in ("/", *map(str, mountpoints)))
+    mountpoints[0].mkdir()
+    copies.clear()
+    grml2usb.exec_copy(str(tmp_path / "iso1" / "grub"), str(mountpoints[0]) + "/")
+    mountpoints[0].rename(mountpoints[1])
+    grml2usb.exec_copy(str(tmp_path / "iso2" / "grub"), str(mountpoints[1]) + "/")
+    assert copies == [str(tmp_path / "iso1" / "grub")]
+    assert (grml2usb.DEDUP.saved_files, grml2usb.DEDUP.saved_bytes) == (2, 13)
+
+
+def test_exec_copy_graft_points(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    monkeypatch.setattr(grml2usb, "GRAFT_MIN_SIZE", 10)
+    target = tmp_path / "cddir"
+    (target / "boot").mkdir(parents=True)
+    monkeypatch.setattr(grml2usb, "GRAFT_POINTS", grml2usb.GraftPoints(str(target)))
+    source = tmp_path / "iso"
+    (source / "boot" / "grml").mkdir(parents=True)
+    (source / "boot" / "grml" / "vmlinuz").write_text("small")
+    (source / "boot" / "grml" / "initrd=1.img").write_text("large initrd")
+    mounted = tmp_path / "mounted"
+    mounted.mkdir()
+    (mounted / "grml.squashfs").write_text("large squashfs")
+    monkeypatch.setattr(grml2usb, "TMPFILES", {str(mounted)})
+
+    grml2usb.exec_copy(str(source / "boot" / "grml"), str(target / "boot"))
+    grml2usb.exec_copy(str(mounted / "grml.squashfs"), str(target / "live") + "/")
+
+    assert (target / "boot" / "grml" / "vmlinuz").read_text() == "small"
+    assert not (target / "boot" / "grml" / "initrd=1.img").exists()
+    # files of ISOs mounted by grml2usb are gone when xorriso runs
+    assert (target / "live" / "grml.squashfs").read_text() == "large squashfs"
+    graft_points = tmp_path / "graft-points"
+    grml2usb.GRAFT_POINTS.save(str(graft_points))
+    assert graft_points.read_text() == f"/boot/grml/initrd\\=1.img={source}/boot/grml/initrd\\=1.img\n"
+
+
+def test_sync_target(tmp_path, monkeypatch):
+    programs = []
+    monkeypatch.setattr(grml2usb, "run_program", lambda args, **kwargs: programs.append(args))
+    (tmp_path / "file").write_text("data")
+    grml2usb.sync_target(str(tmp_path))
+    # syncfs of the target filesystem, no global sync
+    assert programs == []
+
+
+def _susp(signature: bytes, data: bytes) -> bytes:
+    return signature + bytes([4 + len(data), 1]) + data
+
+
+def _iso_record(name: bytes, extent: int, size: int, flags: int = 0, system_use: bytes = b"") -> bytes:
+    length = 33 + len(name) + (len(name) + 1) % 2 + len(system_use)
+    record = bytearray(length + length % 2)
+    record[0] = len(record)
+    struct.pack_into("<I4xI", record, 2, extent, size)
+    record[18:25] = bytes([124, 1, 2, 3, 4, 5, 0])  # 2024-01-02 03:04:05 UTC
+    record[25] = flags
+    record[32] = len(name)
+    record[33 : 33 + len(name)] = name
+    record[length - len(system_use) : length] = system_use
+    return bytes(record)
+
+
+def _rock_ridge(name: str, mode: int) -> bytes:
+    return _susp(b"NM", b"\0" + name.encode()) + _susp(b"PX", struct.pack("<I", mode) + bytes(28))
+
+
+def test_stage_iso(tmp_path, monkeypatch):
+    big_data = os.urandom(3048)
+    sectors = [bytes(2048)] * 16
+    descriptor = bytearray(b"\x01CD001\x01" + bytes(2041))
+    descriptor[156:190] = _iso_record(b"\0", 18, 2048, flags=0x02)
+    sectors += [bytes(descriptor), b"\xffCD001\x01" + bytes(2041)]
+    root = [
+        _iso_record(b"\0", 18, 2048, 0x02, _susp(b"SP", b"\xbe\xef\0") + _rock_ridge(".", 0o40755)),
+        _iso_record(b"\1", 18, 2048, 0x02),
+        _iso_record(b"BOOT", 19, 2048, 0x02, _rock_ridge("boot", 0o40555)),
+        _iso_record(b"HELLO.TXT;1", 20, 5, 0, _rock_ridge("hello.txt", 0o100400)),
+        _iso_record(
+            b"LINK.;1",
+            0,
+            0,
+            0,
+            _rock_ridge("link", 0o120777) + _susp(b"SL", b"\0" + b"\0\4boot" + b"\0\x0cbig.squashfs"),
+        ),
+    ]
+    boot = [
+        _iso_record(b"\0", 19, 2048, 0x02),
+        _iso_record(b"\1", 18, 2048, 0x02),
+        _iso_record(b"BIG.SQU;1", 21, 2048, 0x80, _rock_ridge("big.squashfs", 0o100644)),
+        _iso_record(b"BIG.SQU;1", 22, 1000, 0, _rock_ridge("big.squashfs", 0o100644)),
+    ]
+    sectors += [b"".join(root).ljust(2048, b"\0"), b"".join(boot).ljust(2048, b"\0"), b"hello".ljust(2048, b"\0")]
+    sectors += [big_data[:2048], big_data[2048:].ljust(2048, b"\0")]
+    iso = tmp_path / "grml.iso"
+    iso.write_bytes(b"".join(sectors))
+
+    monkeypatch.setattr(grml2usb, "ISO_STAGE_LIMIT", 1024)
+    monkeypatch.setattr(grml2usb, "ISO_EXTENTS", {})
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "rsync")
+    stage = tmp_path / "stage"
+    stage.mkdir()
+    assert grml2usb.stage_iso(str(iso), str(stage))
+
+    assert (stage / "hello.txt").read_bytes() == b"hello"
+    # read-only modes of the image are not taken over
+    assert (stage / "hello.txt").stat().st_mode & 0o777 == 0o600
+    assert (stage / "boot").stat().st_mode & 0o200
+    assert (stage / "hello.txt").stat().st_mtime == 1704164645
+    assert os.readlink(stage / "link") == "boot/big.squashfs"
+    # large files are not extracted, but read from the ISO when copying them
+    assert (stage / "boot" / "big.squashfs").stat().st_size == len(big_data)
+    assert grml2usb.read_source(str(stage / "boot" / "big.squashfs"), 2000, 100) == big_data[2000:2100]
+    assert grml2usb.hash_file(str(stage / "boot" / "big.squashfs"), "sha256") == hashlib.sha256(big_data).hexdigest()
+    target = tmp_path / "target"
+    target.mkdir()
+    grml2usb.exec_copy(str(stage / "boot"), str(target))
+    assert (target / "boot" / "big.squashfs").read_bytes() == big_data
+
+    # copy_file_data() may move the position of the file descriptor of the image, reading it must not depend on it
+    image = grml2usb.IsoImage(str(iso))
+    try:
+        for sector in range(16, 22):
+            image.read(sector * 2048, 1)
+            os.lseek(image.fh.fileno(), 0, os.SEEK_SET)
+            assert image.read(21 * 2048, len(big_data)) == big_data
+    finally:
+        image.close()
+
+    grml2usb.drop_staged_source(str(stage))
+    assert grml2usb.ISO_EXTENTS == {}
+    assert not stage.exists()
+
+    # anything else is left to mounting the image
+    not_an_iso = tmp_path / "not-an-iso"
+    not_an_iso.write_bytes(bytes(64 * 1024))
+    stage.mkdir()
+    assert not grml2usb.stage_iso(str(not_an_iso), str(stage))
+    assert list(stage.iterdir()) == []
+
+
+def test_build_fat_image(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    (source / "boot" / "grub").mkdir(parents=True)
+    (source / "EFI" / "BOOT").mkdir(parents=True)
+    (source / "boot" / "grub" / "grub.cfg").write_text("menuentry")
+    (source / "EFI" / "BOOT" / "BOOTX64.EFI").write_bytes(os.urandom(5000))
+    (source / "a long name with spaces.txt").write_text("long")
+    (source / "Mixed.Cfg").write_text("mixed")
+    (source / "mixed.cfg2").write_text("lfn")
+    (source / "empty").touch()
+    large = tmp_path / "large.squashfs"
+    large_data = os.urandom(3 * 4096 + 100)
+    large.write_bytes(large_data)
+    for index in range(300):  # directory spanning several clusters
+        (source / "boot" / f"file{index}.c32").write_text(str(index))
+    os.utime(source / "empty", (1704164646, 1704164646))
+
+    # large files are referenced instead of copied into the staging directory
+    monkeypatch.setattr(grml2usb, "ISO_STAGE_LIMIT", 4096)
+    monkeypatch.setattr(grml2usb, "ISO_EXTENTS", {})
+    monkeypatch.setattr(grml2usb, "IMAGE_STAGING", str(source))
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "rsync")
+    grml2usb.exec_copy(str(large), str(source / "live") + "/")
+    assert str(source / "live" / "large.squashfs") in grml2usb.ISO_EXTENTS
+
+    image = tmp_path / "grml.img"
+    grml2usb.build_fat_image(str(source), str(image))
+
+    extracted = tmp_path / "extracted"
+    extracted.mkdir()
+    with image.open("rb") as fh:
+        fat = grml2usb.FatImage(lambda offset, length: os.pread(fh.fileno(), length, offset))
+        assert fat.fat_bits == 32
+        fat.extract(str(extracted))
+
+    assert (extracted / "live" / "large.squashfs").read_bytes() == large_data
+    assert sorted(path.name for path in extracted.iterdir()) == sorted(path.name for path in source.iterdir())
+    for path in source.rglob("*"):
+        if path.is_file() and path.parent.name != "live":
+            assert (extracted / path.relative_to(source)).read_bytes() == path.read_bytes()
+    assert (extracted / "empty").stat().st_mtime == 1704164646
+
+    # FSInfo sector: lead signature, struct signature, free count, next free cluster, trail signature
+    data = image.read_bytes()
+    fsinfo = data[struct.unpack_from("<H", data, 48)[0] * 512 :][:512]
+    assert struct.unpack_from("<I", fsinfo, 0)[0] == 0x41615252
+    assert fsinfo[4:484] == bytes(480)
+    assert fsinfo[496:508] == bytes(12)
+    assert struct.unpack_from("<III", fsinfo, 484)[0] == 0x61417272
+    assert struct.unpack_from("<I", fsinfo, 508)[0] == 0xAA550000
+    if grml2usb.which("fsck.fat"):
+        subprocess.run(["fsck.fat", "-n", str(image)], check=True)
+
+
+def test_build_fat_image_mounted_source(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    iso_mount = tmp_path / "iso"
+    (iso_mount / "live").mkdir(parents=True)
+    large_data = os.urandom(3 * 4096 + 100)
+    (iso_mount / "live" / "large.squashfs").write_bytes(large_data)
+    source.mkdir()
+
+    monkeypatch.setattr(grml2usb, "ISO_STAGE_LIMIT", 4096)
+    monkeypatch.setattr(grml2usb, "ISO_EXTENTS", {})
+    monkeypatch.setattr(grml2usb, "IMAGE_STAGING", str(source))
+    monkeypatch.setattr(grml2usb, "MOUNTED", {str(iso_mount)})
+    grml2usb.exec_copy(str(iso_mount / "live"), str(source) + "/")
+    # the image is unmounted before the filesystem image is written, so its files are copied
+    assert grml2usb.ISO_EXTENTS == {}
+    shutil.rmtree(iso_mount)
+
+    image = tmp_path / "grml.img"
+    grml2usb.build_fat_image(str(source), str(image))
+    extracted = tmp_path / "extracted"
+    extracted.mkdir()
+    with image.open("rb") as fh:
+        grml2usb.FatImage(lambda offset, length: os.pread(fh.fileno(), length, offset)).extract(str(extracted))
+    assert (extracted / "live" / "large.squashfs").read_bytes() == large_data
+
+
+@pytest.mark.parametrize("suffix", [".img", ".img.zst", ".img.xz"])
+def test_write_disk_image(tmp_path, monkeypatch, suffix):
+    if suffix != ".img" and not grml2usb.which(grml2usb.DISK_IMAGE_COMPRESSORS[Path(suffix).suffix][0]):
+        pytest.skip(f"no compressor for {suffix} available")
+    options = argparse.Namespace()
+    options.tmpdir = str(tmp_path)
+    monkeypatch.setattr(grml2usb, "options", options)
+    source = tmp_path / "source"
+    (source / "EFI" / "BOOT").mkdir(parents=True)
+    (source / "EFI" / "BOOT" / "BOOTX64.EFI").write_bytes(os.urandom(5000))
+
+    image = tmp_path / f"grml{suffix}"
+    grml2usb.write_disk_image(str(source), str(image))
+    raw_image = tmp_path / "grml.img"
+    if suffix == ".img.zst":
+        subprocess.run(["zstd", "-d", "-q", str(image), "-o", str(raw_image)], check=True)
+    elif suffix == ".img.xz":
+        subprocess.run(["xz", "-d", "-k", str(image)], check=True)
+    # the temporary uncompressed image is removed
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted({"source", image.name, raw_image.name})
+
+    if suffix == ".img":
+        # unused clusters are not written
+        assert image.stat().st_blocks * 512 < image.stat().st_size
+    data = raw_image.read_bytes()
+    status, partition_type, start, sectors = struct.unpack_from("<B3xB3xII", data, 446)
+    assert (status, partition_type, start) == (0x80, 0x0C, 2048)
+    assert data[510:512] == b"\x55\xaa"
+    assert len(data) == (start + sectors) * 512
+    # the filesystem knows where its partition starts
+    assert struct.unpack_from("<I", data, start * 512 + 28)[0] == start
+
+    extracted = tmp_path / "extracted"
+    extracted.mkdir()
+    fat = grml2usb.FatImage(lambda offset, length: data[start * 512 + offset : start * 512 + offset + length])
+    fat.extract(str(extracted))
+    assert (extracted / "EFI" / "BOOT" / "BOOTX64.EFI").read_bytes() == (
+        source / "EFI" / "BOOT" / "BOOTX64.EFI"
+    ).read_bytes()
+
+
+def test_copy_file_data_fallback(tmp_path, monkeypatch):
+    def unsupported(*args):
+        raise OSError(grml2usb.errno.EXDEV, "cross-device")
+
+    monkeypatch.setattr(os, "copy_file_range", unsupported)
+    monkeypatch.setattr(os, "sendfile", unsupported)
+    data = os.urandom(grml2usb.NATIVE_COPY_CHUNK_SIZE + 4711)
+    (tmp_path / "source").write_bytes(data)
+    with (tmp_path / "source").open("rb") as src, (tmp_path / "target").open("wb") as dst:
+        grml2usb.copy_file_data(src.fileno(), dst.fileno(), len(data))
+    assert (tmp_path / "target").read_bytes() == data
+
+
+def test_exec_native_copy_no_space_left(tmp_path, monkeypatch, caplog):
+    def no_space(*args):
+        raise OSError(grml2usb.errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(grml2usb, "native_copy_path", no_space)
+    monkeypatch.setattr(grml2usb, "cleanup", lambda: None)
+    with pytest.raises(SystemExit):
+        grml2usb.exec_native_copy(str(tmp_path / "source"), str(tmp_path / "target"))
+    assert "No space left on device" in caplog.text
+
+
+def test_incremental_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    source = tmp_path / "source"
+    (source / "kernel").mkdir(parents=True)
+    (source / "kernel" / "vmlinuz").write_bytes(os.urandom(4096))
+    (source / "flavour.squashfs").write_bytes(os.urandom(3 * grml2usb.SAMPLE_HASH_SIZE))
+    target = tmp_path / "target"
+    (target / "conf").mkdir(parents=True)
+
+    copies = []
+    native_copy = grml2usb.exec_native_copy
+    monkeypatch.setattr(grml2usb, "exec_native_copy", lambda *args: copies.append(args[:2]) or native_copy(*args))
+
+    def install():
+        monkeypatch.setattr(grml2usb, "INSTALL_MANIFEST", grml2usb.InstallManifest(str(target)))
+        grml2usb.exec_copy(str(source / "flavour.squashfs"), str(target / "flavour.squashfs"))
+        grml2usb.exec_copy(str(source / "kernel"), str(target) + "/")
+        grml2usb.close_install_manifest()
+
+    # the files are hashed while copying them, and not read again for an unchanged refresh
+    hash_file = grml2usb.hash_file
+    monkeypatch.setattr(grml2usb, "hash_file", lambda path, *args, **kwargs: pytest.fail(f"{path} read again"))
+    install()
+    assert len(copies) == 2
+    manifest = json.loads((target / "conf" / grml2usb.MANIFEST_FILE).read_text())
+    assert sorted(manifest["files"]) == ["flavour.squashfs", "kernel/vmlinuz"]
+    squashfs_digest = hashlib.sha256((source / "flavour.squashfs").read_bytes()).hexdigest()
+    assert manifest["files"]["flavour.squashfs"]["sha256"] == squashfs_digest
+
+    copies.clear()
+    install()
+    assert copies == []
+    monkeypatch.setattr(grml2usb, "hash_file", hash_file)
+
+    # a file modified on the target is installed again
+    (target / "kernel" / "vmlinuz").write_bytes(b"modified")
+    install()
+    assert copies == [(str(source / "kernel"), str(target) + "/")]
+    assert (target / "kernel" / "vmlinuz").read_bytes() == (source / "kernel" / "vmlinuz").read_bytes()
+
+    # with --verify so is a file damaged in the middle, keeping its size and mtime
+    monkeypatch.setattr(grml2usb, "VERIFIER", grml2usb.CopyVerifier())
+    copies.clear()
+    squashfs = target / "flavour.squashfs"
+    mtime = squashfs.stat().st_mtime_ns
+    with squashfs.open("r+b") as fh:
+        fh.seek(grml2usb.SAMPLE_HASH_SIZE + 4711)
+        fh.write(b"damaged")
+    os.utime(squashfs, ns=(mtime, mtime))
+    install()
+    assert copies == [(str(source / "flavour.squashfs"), str(squashfs))]
+    assert squashfs.read_bytes() == (source / "flavour.squashfs").read_bytes()
+
+
+def test_incremental_delta_update(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    monkeypatch.setattr(grml2usb, "DELTA_BLOCK_SIZE", 4096)
+    monkeypatch.setattr(grml2usb, "DELTA_MIN_SIZE", 4096)
+    source = tmp_path / "flavour.squashfs"
+    target = tmp_path / "target"
+    (target / "conf").mkdir(parents=True)
+    written = []
+    write_all = grml2usb.write_all
+    monkeypatch.setattr(grml2usb, "write_all", lambda fd, data: written.append(len(data)) or write_all(fd, data))
+
+    def install(data: bytes) -> None:
+        source.write_bytes(data)
+        monkeypatch.setattr(grml2usb, "INSTALL_MANIFEST", grml2usb.InstallManifest(str(target)))
+        grml2usb.exec_copy(str(source), str(target) + "/")
+        grml2usb.close_install_manifest()
+        assert (target / "flavour.squashfs").read_bytes() == data
+
+    build = bytearray(os.urandom(8 * 4096))
+    install(bytes(build))
+
+    # the blocks on the target are compared with the new build
+    written.clear()
+    build[3 * 4096] ^= 0xFF
+    install(bytes(build + b"appended"))
+    assert written == [4096, 8]
+
+    # damage on the target is repaired, even though the manifest matches the previous build
+    written.clear()
+    with (target / "flavour.squashfs").open("r+b") as fh:
+        fh.seek(4096 + 17)
+        fh.write(b"damaged")
+    build[5 * 4096 + 17] ^= 0xFF
+    install(bytes(build[:-100]))
+    assert written == [4096, 4096]
+
+    # a failed update does not leave a half-written file behind
+    def no_space(*args):
+        raise OSError(grml2usb.errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(grml2usb, "write_all", no_space)
+    monkeypatch.setattr(grml2usb, "cleanup", lambda: None)
+    build[0] ^= 0xFF
+    source.write_bytes(bytes(build))
+    monkeypatch.setattr(grml2usb, "INSTALL_MANIFEST", grml2usb.InstallManifest(str(target)))
+    with pytest.raises(SystemExit):
+        grml2usb.exec_copy(str(source), str(target) + "/")
+    assert not (target / "flavour.squashfs").exists()
+
+
+def test_preallocate_files(tmp_path, caplog):
+    source = tmp_path / "source"
+    (source / "live").mkdir(parents=True)
+    (source / "live" / "flavour.squashfs").write_bytes(os.urandom(2 * grml2usb.PREALLOCATE_MIN_SIZE))
+    (source / "live" / "filesystem.module").write_text("flavour.squashfs\n")
+    target = tmp_path / "target"
+
+    # rsync --inplace fills the empty files, which already have their clusters allocated
+    grml2usb.preallocate_files(str(source / "live"), str(target) + "/")
+    squashfs = target / "live" / "flavour.squashfs"
+    assert squashfs.stat().st_size == 0
+    if squashfs.stat().st_blocks == 0:
+        pytest.skip("filesystem does not support fallocate")
+    assert squashfs.stat().st_blocks * 512 >= 2 * grml2usb.PREALLOCATE_MIN_SIZE
+    assert not (target / "live" / "filesystem.module").exists()
+
+    squashfs.write_bytes((source / "live" / "flavour.squashfs").read_bytes())
+    caplog.set_level(logging.DEBUG)
+    grml2usb.report_fragmentation(str(target))
+    assert "extent(s) for live/flavour.squashfs" in caplog.text
+
+
+def test_verify_copied_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    iso_mount = tmp_path / "iso"
+    (iso_mount / "live").mkdir(parents=True)
+    (iso_mount / "GRML" / "flavour").mkdir(parents=True)
+    squashfs = os.urandom(grml2usb.NATIVE_COPY_SMALL_FILE + 12345)
+    (iso_mount / "live" / "flavour.squashfs").write_bytes(squashfs)
+    (iso_mount / "live" / "filesystem.module").write_text("flavour.squashfs\n")
+    (iso_mount / "GRML" / "flavour" / "md5sums").write_text(
+        f"{hashlib.md5(squashfs).hexdigest()}  ./live/flavour.squashfs\n"
+        f"{hashlib.md5(b'corrupt').hexdigest()}  ./live/filesystem.module\n"
+    )
+    target = tmp_path / "target"
+    target.mkdir()
+
+    verifier = grml2usb.CopyVerifier()
+    verifier.load_checksums(str(iso_mount))
+    monkeypatch.setattr(grml2usb, "VERIFIER", verifier)
+
+    grml2usb.exec_copy(str(iso_mount / "live" / "flavour.squashfs"), str(target) + "/")
+    verifier.check(readback=True)
+
+    grml2usb.exec_copy(str(iso_mount / "live" / "filesystem.module"), str(target) + "/")
+    with pytest.raises(grml2usb.VerifyException):
+        verifier.check(readback=False)
+
+    # the files written by rsync are hashed on the target
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "rsync")
+    monkeypatch.setattr(
+        grml2usb, "exec_rsync", lambda source, target: Path(target, "flavour.squashfs").write_bytes(b"x")
+    )
+    grml2usb.exec_copy(str(iso_mount / "live" / "flavour.squashfs"), str(target) + "/")
+    with pytest.raises(grml2usb.VerifyException):
+        verifier.check(readback=False)
+
+
+def test_progress_reporter(tmp_path, monkeypatch):
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    monkeypatch.setattr(grml2usb, "PROGRESS_INTERVAL", 0)
+    data = os.urandom(grml2usb.NATIVE_COPY_CHUNK_SIZE * 2 + 1)
+    (tmp_path / "source").write_bytes(data)
+
+    with (tmp_path / "progress.json").open("w") as progress_file:
+        reporter = grml2usb.ProgressReporter(json_fd=progress_file.fileno())
+        monkeypatch.setattr(grml2usb, "PROGRESS", reporter)
+        reporter.add_total(len(data) * 2)
+        with grml2usb.phase("copy"):
+            grml2usb.exec_copy(str(tmp_path / "source"), str(tmp_path / "native"))
+            # external copy processes are monitored by polling the destination
+            with reporter.watch([(str(tmp_path / "source"), str(tmp_path / "watched"))]):
+                (tmp_path / "watched").write_bytes(data)
+        reporter.summary()
+
+    events = [json.loads(line) for line in (tmp_path / "progress.json").read_text().splitlines()]
+    assert [event["event"] for event in events if event["event"] != "progress"] == [
+        "phase-start",
+        "file",
+        "file",
+        "phase-end",
+        "summary",
+    ]
+    progress = [event for event in events if event["event"] == "progress"]
+    assert progress[-1]["bytes"] == progress[-1]["total_bytes"] == len(data) * 2
+    assert progress[-1]["eta"] == 0
+    assert events[-1]["bytes"] == len(data) * 2
+    assert "copy" in events[-1]["phases"]
+
+
+def test_progress_phase_wall_time():
+    reporter = grml2usb.ProgressReporter()
+    barrier = threading.Barrier(4)
+
+    def copy() -> None:
+        with reporter.phase("copy"):
+            barrier.wait()
+            time.sleep(0.2)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=copy) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the threads copied at the same time, so the phase took as long as one of them
+    assert 0.2 <= reporter.phases["copy"] <= time.monotonic() - start
+
+
+def test_tracer(tmp_path, monkeypatch):
+    tracer = grml2usb.Tracer()
+    monkeypatch.setattr(grml2usb, "TRACER", tracer)
+
+    with grml2usb.phase("copy"):
+        grml2usb.run_program(["true"])
+        grml2usb.run_program(["false"], check=False)
+        with pytest.raises(subprocess.CalledProcessError):
+            grml2usb.run_program(["sh", "-c", "exit 3"])
+    tracer.save(str(tmp_path / "trace.json"))
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    assert [(event["cat"], event["name"]) for event in spans] == [
+        ("subprocess", "true"),
+        ("subprocess", "false"),
+        ("subprocess", "sh"),
+        ("phase", "copy"),
+    ]
+    assert [event["args"]["exit_code"] for event in spans[:3]] == [0, 1, 3]
+    assert spans[2]["args"]["argv"] == ["sh", "-c", "exit 3"]
+    assert "CalledProcessError" in spans[2]["args"]["error"]
+    # the phase encloses the programs run in it
+    assert spans[3]["ts"] <= spans[0]["ts"]
+    assert spans[3]["ts"] + spans[3]["dur"] >= spans[2]["ts"] + spans[2]["dur"]
+    assert any(event["ph"] == "M" and event["name"] == "process_name" for event in events)
+
+
+def test_tune_copy(tmp_path, monkeypatch, caplog):
+    options = argparse.Namespace()
+    options.dryrun = False
+    options.flashaware = False
+    options.isos = ["grml-full.iso", "grml-small.iso"]
+    options.jobs = None
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    monkeypatch.setattr(grml2usb, "NATIVE_COPY_CHUNK_SIZE", 64 * 1024)
+    monkeypatch.setattr(grml2usb, "PROBE_BLOCK_SIZES", (64 * 1024, 128 * 1024))
+    monkeypatch.setattr(grml2usb, "PROBE_SIZE", 256 * 1024)
+    monkeypatch.setattr(grml2usb, "PROBE_SUSTAINED_SIZE", 1024 * 1024)
+    # every device is reported as slow
+    monkeypatch.setattr(grml2usb, "PROBE_SLOW_RATE", 1024**4)
+    target = tmp_path / "target"
+    target.mkdir()
+
+    with (tmp_path / "progress.json").open("w") as progress_file:
+        monkeypatch.setattr(grml2usb, "PROGRESS", grml2usb.ProgressReporter(json_fd=progress_file.fileno()))
+        grml2usb.tune_copy([str(target)])
+
+    events = [json.loads(line) for line in (tmp_path / "progress.json").read_text().splitlines()]
+    result = next(event for event in events if event["event"] == "probe")
+    assert [(measurement["block_size"], measurement["depth"]) for measurement in result["measurements"]] == [
+        (64 * 1024, 1),
+        (128 * 1024, 1),
+        (result["block_size"], 2),
+        (result["block_size"], 4),
+    ]
+    assert result["sustained_rate"] > 0 and result["read_rate"] > 0
+    assert grml2usb.NATIVE_COPY_CHUNK_SIZE == result["block_size"]
+    assert options.jobs == result["depth"]
+    assert "is very slow" in caplog.text
+    # nothing is left behind on the target
+    assert list(target.iterdir()) == []
+
+    # the results which do not apply to the installation are reported
+    caplog.clear()
+    caplog.set_level(logging.INFO)
+    options.isos = ["grml-full.iso"]
+    options.jobs = None
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "rsync")
+    monkeypatch.setattr(grml2usb, "PROGRESS", None)
+    monkeypatch.setattr(grml2usb, "probe_target", lambda device: dict(result, depth=2))
+    grml2usb.tune_copy([str(target)])
+    assert "files are copied by rsync" in caplog.text
+    assert "Writing files in chunks" not in caplog.text
+    assert "Not using 2 parallel jobs" in caplog.text
+    assert options.jobs is None
+
+
+def test_fat32_layout(tmp_path, monkeypatch, caplog):
+    def data_start(size, offset, cluster_size, reserved):
+        # how mkfs.fat -a lays out FAT32 with these parameters
+        clusters = ((size // 512 - reserved) * 512 + 2 * 8) // (cluster_size + 2 * 4)
+        return offset + (reserved + 2 * -(-((clusters + 2) * 4) // 512)) * 512
+
+    for size, offset in ((8 * 1024**3, 1024**2), (16 * 1024**3 - 1536, 63 * 512), (3 * 1024**3, 63 * 512)):
+        cluster_size, reserved = grml2usb.fat32_layout(size, offset, 4 * 1024**2)
+        assert cluster_size == 32 * 1024
+        assert grml2usb.FAT_RESERVED_SECTORS <= reserved <= 0xFFFF
+        assert data_start(size, offset, cluster_size, reserved) % (4 * 1024**2) == 0
+
+    # mkfs.vfat must not round the reserved sectors to whole clusters
+    options = argparse.Namespace()
+    options.dryrun = True
+    options.flashaware = True
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "get_flash_geometry", lambda device: (4 * 1024**2, 63 * 512))
+    image = tmp_path / "partition.img"
+    with open(image, "wb") as fh:
+        fh.truncate(3 * 1024**3)
+    caplog.set_level(logging.INFO)
+    grml2usb.mkfs_vfat(str(image))
+    assert f"mkfs.vfat -a -F 32 -s 64 -R {grml2usb.fat32_layout(3 * 1024**3, 63 * 512, 4 * 1024**2)[1]}" in caplog.text
+    # FAT32 needs at least 65525 clusters, smaller clusters are used for small partitions
+    assert grml2usb.fat32_layout(1024**3, 0, 4 * 1024**2)[0] == 8 * 1024
+    assert grml2usb.fat32_layout(16 * 1024**2, 0, 4 * 1024**2) is None
+
+
+def test_align_copy_chunks(tmp_path, monkeypatch):
+    geometry = {"/dev/sdb1": 8 * 1024**2, "/dev/sdc1": 12 * 1024**2}
+    monkeypatch.setattr(grml2usb, "get_flash_geometry", lambda device: (geometry[device], 0))
+    monkeypatch.setattr(grml2usb, "NATIVE_COPY_CHUNK_SIZE", grml2usb.NATIVE_COPY_CHUNK_DEFAULT)
+    grml2usb.align_copy_chunks(["/dev/sdb1"], 4 * 1024**2)
+    assert grml2usb.NATIVE_COPY_CHUNK_SIZE == 8 * 1024**2
+    # the writes cover the erase blocks of all devices, the result does not depend on earlier calls
+    grml2usb.align_copy_chunks(["/dev/sdb1", "/dev/sdc1", str(tmp_path)], 64 * 1024**2)
+    assert grml2usb.NATIVE_COPY_CHUNK_SIZE == 72 * 1024**2
+    grml2usb.align_copy_chunks(["/dev/sdb1", "/dev/sdc1"], 64 * 1024**2)
+    assert grml2usb.NATIVE_COPY_CHUNK_SIZE == 72 * 1024**2
+
+
+@pytest.mark.skipif(shutil.which("mkfs.vfat") is None, reason="mkfs.vfat not available")
+def test_mkfs_vfat_flash_aware(tmp_path, monkeypatch, caplog):
+    options = argparse.Namespace()
+    options.dryrun = False
+    options.flashaware = True
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "get_flash_geometry", lambda device: (4 * 1024**2, 1024**2))
+    image = tmp_path / "partition.img"
+    with open(image, "wb") as fh:
+        fh.truncate(3 * 1024**3)
+    caplog.set_level(logging.INFO)
+    grml2usb.mkfs_vfat(str(image))
+    assert "aligned to 4.0 MiB" in caplog.text
+    assert "not aligned" not in caplog.text
+
+
 def _run_x(args, check: bool = True, **kwargs):
     # str-ify Paths, not necessary, but for readability in logs.
     args = [arg if isinstance(arg, str) else str(arg) for arg in args]
@@ -476,6 +1607,39 @@ def test_copy_bootloader_files(
         assert (target / "boot" / "syslinux" / "syslinux.c32").exists()
 
 
+def test_config_cache_output_identical(tmp_path, monkeypatch, iso_contents: Path) -> None:
+    options = argparse.Namespace()
+    options.bootoptions = ["lang=de", "ssh=%flavour"]
+    options.dryrun = False
+    options.removeoption = ["quiet"]
+    options.skipsyslinuxconfig = False
+    options.skipgrubconfig = False
+    options.syslinuxlibs = []
+    options.tmpdir = str(tmp_path)
+    monkeypatch.setattr(grml2usb, "options", options)
+    monkeypatch.setattr(grml2usb, "COPY_ENGINE", "native")
+    monkeypatch.setattr(grml2usb, "handle_secure_boot", lambda *args: None)
+    monkeypatch.setattr(grml2usb.uuid, "uuid4", lambda: uuid.UUID(int=0))
+
+    def install(target: Path, cached: bool) -> dict:
+        target.mkdir()
+        options.bootloader = "syslinux"
+        if cached:
+            grml2usb.open_config_cache()
+        for iso_name, flavour in (
+            ("grml-full-2025.12-amd64", "grml-full-amd64"),
+            ("grml-full-2025.12-arm64", "grml-full-arm64"),
+            ("grml-full-2025.12-amd64", "grml-full-amd64"),
+        ):
+            grml2usb.copy_bootloader_files(str(iso_contents / iso_name), str(target), flavour)
+        if cached:
+            grml2usb.close_config_cache()
+        return {path.relative_to(target): path.read_bytes() for path in target.rglob("*") if path.is_file()}
+
+    # every configuration file is written once, with the same result as modifying the files in place
+    assert install(tmp_path / "cached", True) == install(tmp_path / "direct", False)
+
+
 @pytest.mark.parametrize("only_activate", [True, False])
 def test_install_mbr(tmp_path, monkeypatch, only_activate: bool) -> None:
     monkeypatch.setattr(grml2usb, "set_rw", lambda *args: None)
@@ -573,6 +1737,7 @@ def iso_amd64(tmp_path_factory):
     [
         pytest.param([], True, "Using grub as bootloader", id="defaults"),
         pytest.param(["--bootloader=efi"], False, None, id="bootloader=efi"),
+        pytest.param(["--userspace-iso"], True, "Using grub as bootloader", id="userspace-iso"),
     ],
 )
 def test_smoke(